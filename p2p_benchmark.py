@@ -0,0 +1,187 @@
+# Benchmark every stage of the P2P pipeline on synthetic datasets and store the
+# timings as JSON; with --baseline, stages that got slower fail the run, and with
+# --check-report, so does a parallel report that differs from the sequential one.
+#
+#   python p2p_benchmark.py --sizes 10000 100000 -o bench.json [--baseline main.json] [--check-report]
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import openpyxl
+import pandas as pd
+import p2p_charts
+from p2p_pipeline import FRAME_BUILDERS, AnalysisFrames, apply_schema, process_upload, read_workbook
+from p2p_report import REPORT_SHEETS, REPORT_WORKERS, write_report
+from p2p_synthetic import EXCEL_MAX_ROWS, generate, write_dataset
+
+# Figures of every analysis view; views with a selector are timed on their first option
+VIEW_FIGURES = {
+    'service_area': p2p_charts.service_area_figure,
+    'entity_service_area': lambda frames: p2p_charts.entity_service_area_figure(
+        frames, next(iter(frames['entity_service_area_spend']))),
+    'entity_spend': p2p_charts.entity_spend_figure,
+    'material_spend': p2p_charts.material_spend_figure,
+    'top_materials': p2p_charts.top_materials_figure,
+    'top_vendors': p2p_charts.top_vendors_figure,
+    'vendor_spend': p2p_charts.vendor_spend_figure,
+    'monthly_top_vendors': lambda frames: p2p_charts.monthly_top_vendors_figure(
+        frames, next(iter(frames['top_vendors_by_month']))),
+    'top_vendor_trend': p2p_charts.top_vendor_trend_figure,
+    'spend_trend': p2p_charts.spend_trend_figure,
+    'pending_deliveries': p2p_charts.pending_deliveries_figure,
+    'down_payment': p2p_charts.down_payment_figure,
+    'vendor_overbilling': p2p_charts.vendor_overbilling_figure,
+    'month_overbilling': p2p_charts.month_overbilling_figure,
+    'vendor_underbilling': p2p_charts.vendor_underbilling_figure,
+    'month_underbilling': p2p_charts.month_underbilling_figure
+}
+
+# Stages faster than this are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.01
+
+
+# Seeded dataset of the given size as xlsx bytes, or as a frame when it does not fit
+# in a worksheet. Workbooks are kept in data_dir, as writing them dominates a run.
+def load_dataset(rows, seed, data_dir):
+    if rows > EXCEL_MAX_ROWS:
+        return None, generate(rows, seed=seed)
+    path = Path(data_dir) / f'synthetic-{rows}-{seed}.xlsx'
+    if not path.exists():
+        write_dataset(generate(rows, seed=seed), path)
+    return path.read_bytes(), None
+
+
+# Time every stage once on a fresh copy of the data, in pipeline order
+def run_stages(file_bytes, df, report_path):
+    timings = {}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    if file_bytes is not None:
+        df, _ = timed('read_excel', read_workbook, file_bytes)
+    else:
+        df = df.copy()
+    df = timed('apply_schema', apply_schema, df)
+    frames = AnalysisFrames(timed('process_upload', process_upload, df))
+    # Builders are registered after the frames they depend on, so each timing
+    # covers only that frame's own work
+    for name in FRAME_BUILDERS:
+        timed(f'frame:{name}', frames.__getitem__, name)
+    for view, figure in VIEW_FIGURES.items():
+        timed(f'figure:{view}', figure, frames)
+    timed('write_report', write_report, frames, report_path)
+    return timings, frames
+
+
+# Sheets whose cells differ between a report written on the process pool and one
+# written sequentially. The pool only runs on large reports, so both are forced
+# here; openpyxl loads them in full, as its read-only mode skips the styles and
+# relationships a bad splice breaks, and a report it cannot load differs entirely.
+def check_parallel_report(frames, tmp_dir):
+    reports = []
+    for workers in (1, max(REPORT_WORKERS, 2)):
+        path = Path(tmp_dir) / f'report-{workers}.xlsx'
+        write_report(frames, str(path), workers=workers)
+        try:
+            workbook = openpyxl.load_workbook(path)
+        except Exception:
+            return list(REPORT_SHEETS)
+        reports.append({worksheet.title: list(worksheet.values) for worksheet in workbook.worksheets})
+    sequential, parallel = reports
+    return [sheet for sheet in REPORT_SHEETS if sequential.get(sheet) != parallel.get(sheet)]
+
+
+def run_benchmark(sizes, repeat, seed, data_dir, check_report=False):
+    results = []
+    mismatches = []
+    with tempfile.TemporaryDirectory(prefix='p2p-bench-') as tmp_dir:
+        for rows in sizes:
+            file_bytes, df = load_dataset(rows, seed, data_dir or tmp_dir)
+            runs = [run_stages(file_bytes, df, str(Path(tmp_dir) / 'report.xlsx')) for _ in range(repeat)]
+            for stage in runs[0][0]:
+                seconds = [timings[stage] for timings, _ in runs]
+                results.append({'rows': rows, 'stage': stage, 'seconds': seconds,
+                                'min': min(seconds), 'median': statistics.median(seconds)})
+                print(f'{rows:>10,} {stage:<40} {min(seconds):9.4f} s')
+            if check_report:
+                mismatches.extend({'rows': rows, 'sheet': sheet}
+                                  for sheet in check_parallel_report(runs[0][1], tmp_dir))
+    return results, mismatches
+
+
+# Stages whose best time grew by more than tolerance over the baseline
+def find_regressions(results, baseline, tolerance):
+    previous = {(result['rows'], result['stage']): result['min'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['rows'], result['stage']))
+        if before is None or max(before, result['min']) < MIN_COMPARED_SECONDS:
+            continue
+        if result['min'] > before * (1 + tolerance):
+            regressions.append({'rows': result['rows'], 'stage': result['stage'],
+                                'baseline': before, 'current': result['min']})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the P2P pipeline stages on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000], help='dataset sizes in rows')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per size; the best run is compared')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic datasets')
+    parser.add_argument('--data-dir', type=Path, help='keep the generated workbooks here between runs')
+    parser.add_argument('-o', '--output', type=Path, default=Path('p2p_benchmark.json'), help='results file')
+    parser.add_argument('--baseline', type=Path, help='earlier results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown over the baseline as a fraction (default 0.2)')
+    parser.add_argument('--check-report', action='store_true',
+                        help='also check that the parallel report reads back like the sequential one')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.data_dir is not None:
+        args.data_dir.mkdir(parents=True, exist_ok=True)
+
+    results, mismatches = run_benchmark(args.sizes, args.repeat, args.seed, args.data_dir, args.check_report)
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results
+    }
+
+    status = 0
+    if args.baseline is not None:
+        report['baseline'] = str(args.baseline)
+        report['regressions'] = find_regressions(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in report['regressions']:
+            print(f"Regression at {regression['rows']:,} rows in {regression['stage']}: "
+                  f"{regression['baseline']:.4f} s -> {regression['current']:.4f} s")
+        status = 1 if report['regressions'] else 0
+
+    if args.check_report:
+        report['report_mismatches'] = mismatches
+        for mismatch in mismatches:
+            print(f"Parallel report differs at {mismatch['rows']:,} rows in sheet {mismatch['sheet']!r}")
+        status = 1 if mismatches else status
+
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f'Wrote results to {args.output}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
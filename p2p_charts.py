@@ -0,0 +1,215 @@
+# Plotly figures for the analysis views in p.py, built from AnalysisFrames without
+# touching Streamlit, so the benchmark can time figure construction on its own.
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+# Pie chart that shows both the INR value and percentage for each service area
+def service_area_figure(frames):
+    df_plot = frames['total_spend_by_service_area'].sort_values(by='Total PO Ordered Value', ascending=False)
+    fig = px.pie(df_plot,
+                 values='Total PO Ordered Value',
+                 names='Service Area',
+                 hover_data=['Total PO Invoice Value', 'IT/NON-IT'],
+                 hole=0.3)
+    fig.update_traces(textinfo='label+percent',
+                      texttemplate="₹%{value:,.0f} (%{percent})")
+    return fig
+
+
+# Grouped bar chart with both Ordered and Invoice values by Service Area for one
+# entity, pre-aggregated at load time
+def entity_service_area_figure(frames, entity):
+    service_area_spend = frames['entity_service_area_spend'][entity]
+    fig = go.Figure(data=[
+        go.Bar(
+            name="PO Ordered Value",
+            x=service_area_spend['Service Area'],
+            y=service_area_spend['PO Ordered Value in Loc. Curr.'],
+            marker_color='indianred',
+            text=service_area_spend['PO Ordered Value in Loc. Curr.'],
+            texttemplate="₹%{text:,.0f}",
+            textposition='auto'
+        ),
+        go.Bar(
+            name="PO Invoice Value",
+            x=service_area_spend['Service Area'],
+            y=service_area_spend['PO Invoice Value in Loc. Curr.'],
+            marker_color='lightsalmon',
+            text=service_area_spend['PO Invoice Value in Loc. Curr.'],
+            texttemplate="₹%{text:,.0f}",
+            textposition='auto'
+        )
+    ])
+    fig.update_layout(
+        barmode='group',
+        xaxis_title="Service Area",
+        yaxis_title="Value (INR)",
+        title=f"Spend Analysis for {entity} by Service Area",
+        yaxis_tickprefix="₹",
+        yaxis_tickformat=","
+    )
+    return fig
+
+
+def entity_spend_figure(frames):
+    fig = px.pie(frames['entity_spend'],
+                 names='Entity Name',
+                 values='PO Ordered Value in Loc. Curr.',
+                 title='Spend Distribution Across Entities')
+    fig.update_layout(
+        showlegend=True,
+        legend_title_text='Entities',
+        uniformtext_minsize=12,
+        uniformtext_mode='hide'
+    )
+    return fig
+
+
+def material_spend_figure(frames):
+    df_plot = frames['total_spend_by_material'].sort_values(by='Total PO Ordered Value', ascending=False)
+    fig = px.treemap(df_plot,
+                     path=['Material Description'],
+                     values='Total PO Ordered Value',
+                     color='IT/NON-IT',
+                     hover_data=['Total PO Invoice Value'])
+    fig.update_traces(texttemplate="₹%{value:,.0f}")
+    return fig
+
+
+def top_materials_figure(frames):
+    df_plot = frames['top_10_materials'].sort_values(by='Total PO Ordered Value', ascending=False)
+    fig = px.bar(df_plot,
+                 x='Material Description',
+                 y='Total PO Ordered Value',
+                 color='IT/NON-IT',
+                 hover_data=['Total PO Invoice Value'])
+    fig.update_layout(xaxis={'categoryorder':'total descending'})
+    fig.update_traces(texttemplate="₹%{y:,.0f}", textposition='outside')
+    fig.update_yaxes(tickprefix="₹", tickformat=",")
+    return fig
+
+
+def top_vendors_figure(frames):
+    df_plot = frames['top_10_vendors'].sort_values(by='Total PO Ordered Value', ascending=False)
+    fig = px.bar(df_plot,
+                 x='Vendor Name',
+                 y='Total PO Ordered Value',
+                 color='IT/NON-IT',
+                 orientation='v',
+                 hover_data=['Total PO Invoice Value', 'Vendor Number', 'Entity Name'])
+    fig.update_layout(xaxis={'categoryorder':'total descending'})
+    fig.update_traces(texttemplate="₹%{y:,.0f}", textposition='outside')
+    fig.update_yaxes(tickprefix="₹", tickformat=",")
+    return fig
+
+
+def vendor_spend_figure(frames):
+    fig = px.treemap(frames['vendor_spend'],
+                     path=['Vendor Name'],
+                     values='PO Ordered Value in Loc. Curr.',
+                     hover_data=['PO Invoice Value in Loc. Curr.'],
+                     title='Vendor Spend Distribution')
+    fig.update_layout(
+        coloraxis_colorbar_title="Spend Value (INR)",
+        margin=dict(t=50, l=25, r=25, b=25)
+    )
+    return fig
+
+
+def monthly_top_vendors_figure(frames, month):
+    monthly_data = frames['top_vendors_by_month'][month]
+    fig = px.bar(monthly_data,
+                 x='Vendor Name',
+                 y='Total PO Ordered Value',
+                 color='IT/NON-IT',
+                 title=f'Top Vendors for {month}',
+                 hover_data=['Total PO Invoice Value', 'Entity Name', 'Vendor Number'])
+    fig.update_layout(xaxis_title="Vendor",
+                     yaxis_title="Total PO Ordered Value",
+                     xaxis={'categoryorder':'total descending'})
+    fig.update_traces(texttemplate="₹%{y:,.0f}", textposition='outside')
+    fig.update_yaxes(tickprefix="₹", tickformat=",")
+    return fig
+
+
+def top_vendor_trend_figure(frames):
+    # Get the top vendor for each month
+    top_vendor_monthly = frames['top_10_vendors_monthly'].groupby('Month', observed=True).first().reset_index()
+    fig = px.line(top_vendor_monthly,
+                  x='Month',
+                  y='Total PO Ordered Value',
+                  title='Top Vendor Monthly Trend',
+                  labels={'Total PO Ordered Value': 'Total PO Ordered Value (INR)', 'Month': 'Month'},
+                  hover_data=['Vendor Name', 'Entity Name', 'IT/NON-IT'])
+    fig.update_layout(
+        xaxis_title='Month',
+        yaxis_title='Total PO Ordered Value (INR)',
+        yaxis_tickprefix="₹ ",
+        yaxis_tickformat=".2f"
+    )
+    return fig
+
+
+def spend_trend_figure(frames):
+    fig = px.line(frames['spend_trend'],
+                  x='Month',
+                  y=['PO Ordered Value in Loc. Curr.', 'PO Invoice Value in Loc. Curr.'],
+                  title='Monthly Spend Trend',
+                  labels={'value': 'Value (INR)', 'Month': 'Month'})
+    fig.update_layout(
+        xaxis_title='Month',
+        yaxis_title='Value (INR)',
+        yaxis_tickprefix="₹ ",
+        yaxis_tickformat=".2f"
+    )
+    return fig
+
+
+def pending_deliveries_figure(frames):
+    return px.pie(frames['pending_deliveries'],
+                  values='Pending Deliveries',
+                  names='Vendor Name',
+                  title="Pending Deliveries by Vendor")
+
+
+def down_payment_figure(frames):
+    return px.pie(frames['down_payment'],
+                  values='PO Down Payment',
+                  names='Vendor Name',
+                  title="Down Payment Analysis by Vendor")
+
+
+# Top Vendors by Total Overbilling
+def vendor_overbilling_figure(frames):
+    return px.pie(frames['vendor_overbilling'],
+                  names='Vendor Name',
+                  values='Overbilling Amount',
+                  title="Total Overbilling by Vendor (INR)")
+
+
+def month_overbilling_figure(frames):
+    fig = px.line(frames['month_overbilling'],
+                  x='Month',
+                  y='Overbilling Amount',
+                  title="Monthly Overbilling Trend (INR)",
+                  labels={'Month': 'Month', 'Overbilling Amount': 'Total Overbilling Amount (INR)'})
+    fig.update_yaxes(tickformat=",", exponentformat="none")
+    return fig
+
+
+def vendor_underbilling_figure(frames):
+    return px.pie(frames['vendor_underbilling'],
+                  names='Vendor Name',
+                  values='Underbilling Amount',
+                  title="Total Underbilling by Vendor (INR)")
+
+
+def month_underbilling_figure(frames):
+    fig = px.line(frames['month_underbilling'],
+                  x='Month',
+                  y='Underbilling Amount',
+                  title="Monthly Underbilling Trend (INR)",
+                  labels={'Month': 'Month', 'Underbilling Amount': 'Total Underbilling Amount (INR)'})
+    fig.update_yaxes(tickformat=",", exponentformat="none")
+    return fig
@@ -0,0 +1,816 @@
+# P2P analysis pipeline: reading, processing and report writing without Streamlit,
+# shared by the app in p.py and the command line entry point at the bottom.
+#
+#   python p2p_pipeline.py data.xlsx -o P2P_Analysis_Report.xlsx [--cube cube.parquet]
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+import pandas as pd
+import numpy as np
+from p2p_report import REPORT_FORMATS, REPORT_SHEETS, arrow_table
+
+# Not available on Windows; resident memory is then not measured
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Parquet sidecars are optional; without pyarrow every load parses the workbook
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Shared cache of processed uploads, keyed by a hash of the uploaded bytes
+CACHE_DIR = Path(os.environ.get('P2P_CACHE_DIR', Path(__file__).parent / '.p2p_cache'))
+CACHE_MAX_ENTRIES = int(os.environ.get('P2P_CACHE_MAX_ENTRIES', 8))
+
+# Every cache file name carries a hash of the pipeline and report source, so files
+# written by other code (different processing, payload or report layout) are
+# never read back; they age out of the cache like any other entry
+CACHE_VERSION = hashlib.sha256(b''.join(
+    (Path(__file__).parent / module).read_bytes() for module in ('p2p_pipeline.py', 'p2p_report.py')
+)).hexdigest()[:12]
+
+# Stage measurements are logged as key=value lines on this logger
+logger = logging.getLogger('p2p')
+
+# Every stage records how much the process's resident memory grew over it, which
+# costs two reads of a counter. Peak memory comes from tracemalloc, which slows
+# down stages that create many Python objects, so it is only switched on when
+# P2P_TRACE_MEMORY is set. Both are process wide: stages running concurrently
+# inflate each other's figures, and a stage nested in another restarts the outer
+# stage's peak.
+TRACE_MEMORY = os.environ.get('P2P_TRACE_MEMORY', '') not in ('', '0')
+if TRACE_MEMORY:
+    tracemalloc.start()
+
+# Fields of a stage measurement, in display order
+STAGE_FIELDS = ['stage', 'seconds', 'rows', 'rss_mb', 'peak_mb', 'detail']
+
+
+# Send the stage log lines to stderr unless the 'p2p' logger is already set up;
+# the level comes from P2P_LOG_LEVEL
+def setup_logging():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get('P2P_LOG_LEVEL', 'INFO'))
+
+
+# Resident set size of this process in bytes, read from /proc on Linux. Elsewhere
+# the nearest cheap figure is the peak RSS from getrusage, so deltas there only
+# show growth of the high-water mark; None where neither is available.
+def resident_bytes():
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+# Measure one pipeline stage: wall time, change in resident memory, peak traced
+# memory above the starting point when tracing, and whatever rows/detail the
+# caller fills into the yielded record. The record is appended to stages and
+# logged when the stage ends.
+@contextmanager
+def measure_stage(stages, name):
+    record = dict.fromkeys(STAGE_FIELDS)
+    record['stage'] = name
+    if TRACE_MEMORY:
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = resident_bytes()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        rss_after = resident_bytes()
+        if rss_before is not None and rss_after is not None:
+            record['rss_mb'] = (rss_after - rss_before) / 2**20
+        if TRACE_MEMORY:
+            record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_before) / 2**20
+        stages.append(record)
+        logger.info(' '.join(f'{field}={record[field]:.4f}' if isinstance(record[field], float)
+                             else f'{field}={record[field]}' for field in STAGE_FIELDS))
+
+
+# Columns the analysis reads from the upload and how each one is typed. Other
+# workbook columns are never parsed. 'key' columns keep the type Excel gives them.
+SCHEMA = {
+    'Purchasing Document Number': 'key',
+    'Document Date': 'date',
+    'Delivery Date': 'date',
+    'GR Document Number': 'key',
+    'IR Document Number': 'key',
+    'Vendor Name': 'text',
+    'Vendor Number': 'text',
+    'Entity Name': 'text',
+    'IT/NON-IT': 'text',
+    'Service Area': 'text',
+    'Material Description': 'text',
+    'PO Ordered Value in Loc. Curr.': 'number',
+    'PO Invoice Value in Loc. Curr.': 'number',
+    'Ordered Quantity': 'number',
+    'Delivery Quantity': 'number',
+    'PO Down Payment': 'number',
+    'Still to Deliver': 'number'
+}
+SOURCE_COLUMNS = list(SCHEMA)
+
+# Grouping keys stored as categoricals so the groupbys run on integer codes
+CATEGORY_COLUMNS = ['Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+                    'Service Area', 'Material Description', 'Month']
+
+
+# Excel reader backends in order of preference; calamine needs python-calamine and
+# pandas >= 2.2, openpyxl is always available as the fallback
+EXCEL_ENGINES = ['calamine', 'openpyxl']
+
+
+# Parse the schema columns of the workbook with the fastest available engine and
+# report which one was used
+def read_workbook(file_bytes):
+    read_options = {
+        'usecols': lambda col: col in SCHEMA,
+        'dtype': {col: str for col, kind in SCHEMA.items() if kind == 'text'}
+    }
+    for engine in EXCEL_ENGINES[:-1]:
+        try:
+            return pd.read_excel(BytesIO(file_bytes), engine=engine, **read_options), engine
+        except Exception as error:
+            # Missing engines raise ImportError or ValueError, but a workbook the engine
+            # cannot parse raises its own errors (e.g. CalamineError); every failure
+            # falls through to the next engine, and the last one reports its own
+            logger.warning('reader=%s fallback error=%s', engine, type(error).__name__)
+            continue
+    engine = EXCEL_ENGINES[-1]
+    return pd.read_excel(BytesIO(file_bytes), engine=engine, **read_options), engine
+
+
+# Coerce date and numeric columns the engine could not type on its own, e.g. when
+# a few cells hold text; columns that are already typed are left untouched. Key
+# columns mixing numbers and text become text throughout, as the Parquet sidecar
+# stores them, so a load from the sidecar yields the same frame as the workbook.
+def apply_schema(df):
+    for col, kind in SCHEMA.items():
+        if col not in df.columns:
+            continue
+        if kind == 'date' and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif kind == 'number' and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        elif kind == 'key' and pd.api.types.infer_dtype(df[col]) in ('mixed', 'mixed-integer'):
+            df[col] = df[col].astype(str).where(df[col].notna())
+    return df
+
+
+# Load the upload as a typed frame, preferring the Parquet sidecar written on first upload.
+# Without a file hash the sidecar is neither read nor written. Returns the frame and
+# the name of the reader that produced it.
+def read_upload(file_bytes, file_hash=None):
+    use_sidecar = pq is not None and file_hash is not None
+    sidecar_path = CACHE_DIR / f'upload-{CACHE_VERSION}-{file_hash}.parquet'
+    if use_sidecar and sidecar_path.exists():
+        try:
+            available = set(pq.read_schema(sidecar_path).names)
+            columns = [col for col in SOURCE_COLUMNS if col in available]
+            df = pq.read_table(sidecar_path, columns=columns).to_pandas()
+            refresh_cache(sidecar_path)
+            return df, 'parquet sidecar'
+        except Exception:
+            # Any unreadable sidecar is a cache miss; the workbook is parsed again
+            sidecar_path.unlink(missing_ok=True)
+
+    df, reader = read_workbook(file_bytes)
+    df = apply_schema(df)
+
+    if use_sidecar:
+        write_sidecar(df, sidecar_path)
+    return df, reader
+
+
+# Persist the typed upload so later loads skip Excel parsing entirely
+def write_sidecar(df, sidecar_path):
+    tmp_path = temp_path(sidecar_path)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        try:
+            pq.write_table(arrow_table(df), tmp_path)
+            tmp_path.replace(sidecar_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    except (OSError, pa.ArrowException) as error:
+        logger.warning('cache=%s write error=%s', sidecar_path.name, error)
+        return
+    prune_cache('upload-*.parquet')
+
+
+# Aggregates are small, so their keys go back to plain values for plotly and export
+def plain_keys(frame):
+    categorical = frame.select_dtypes('category').columns
+    return frame.astype({col: frame[col].cat.categories.dtype for col in categorical})
+
+
+# Reasons a PO can be delayed, each a vectorized condition on the processed frame.
+# A PO matching several rules gets all of their reasons, joined in this order.
+DELAY_RULES = [
+    ('PO raised after delivery', lambda df, current_date: df['Delivery Delay'] < 0),
+    ('Goods receipt overdue', lambda df, current_date: (
+        df['GR Document Number'].isna() & (df['Delivery Date'] < current_date))),
+    ('Invoice receipt missing', lambda df, current_date: (
+        df['GR Document Number'].notna() & df['IR Document Number'].isna()))
+]
+
+
+# Label every PO with its delay reasons without any row-wise Python
+def classify_delays(df, current_date):
+    matches = np.column_stack([np.asarray(rule(df, current_date), dtype=bool) for _, rule in DELAY_RULES])
+    # Each row's set of matching rules becomes a bit pattern indexing a label table
+    codes = matches.astype(np.int64) @ (1 << np.arange(len(DELAY_RULES)))
+    labels = ['; '.join(reason for bit, (reason, _) in enumerate(DELAY_RULES) if code >> bit & 1)
+              for code in range(1 << len(DELAY_RULES))]
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+# Grain of the spend cube and the measures summed into it
+VENDOR_KEYS = ['Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT']
+CUBE_KEYS = ['Month', 'Vendor Name', 'Vendor Number', 'Entity Name',
+             'Material Description', 'Service Area', 'IT/NON-IT']
+SPEND_VALUES = ['PO Ordered Value in Loc. Curr.', 'PO Invoice Value in Loc. Curr.', 'PO Down Payment']
+QUANTITY_VALUES = ['Ordered Quantity', 'Delivery Quantity', 'Still to Deliver']
+
+
+# Aggregate the PO frame once at the finest grain any summary needs. Missing keys
+# are kept as their own groups so roll-ups over the other keys stay complete.
+# Pending quantity is derived per row here rather than stored on the PO frame.
+def build_spend_cube(df):
+    measures = df[SPEND_VALUES + QUANTITY_VALUES].assign(
+        **{'Pending Deliveries': df['Ordered Quantity'] - df['Delivery Quantity']})
+    keys = [df[key] for key in CUBE_KEYS]
+    return measures.groupby(keys, observed=True, dropna=False).sum().reset_index()
+
+
+# Reduce the cube to a coarser summary; rows with a missing key are dropped here,
+# as a groupby on the full frame would
+def rollup(cube, keys, values):
+    return cube.groupby(keys, observed=True)[values].sum().reset_index().pipe(plain_keys)
+
+
+# Number of rows kept in the top-N tables
+TOP_N = 10
+
+
+# Largest rows of a table by one column, selected without sorting the whole table
+def top_n(frame, column, n=TOP_N):
+    return frame.nlargest(n, column)
+
+
+# Largest rows by one column within each group, groups in key order
+def top_n_per_group(frame, group, column, n=TOP_N):
+    largest = frame.groupby(group, observed=True)[column].nlargest(n)
+    return frame.loc[largest.index.get_level_values(-1)].reset_index(drop=True)
+
+
+# Add the row-level columns the analysis needs
+def add_row_columns(df):
+    # Create Month column early to ensure availability
+    df['Month'] = df['Document Date'].dt.to_period('M').astype(str)
+
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+
+    # Check for Delivery Date anomalies
+    df['Delivery_Date_Anomaly'] = df['Delivery Date'] < df['Document Date']
+    df['Date_Difference'] = (df['Delivery Date'] - df['Document Date']).dt.days
+
+    # Define current date used by the delay rules and the on-time check
+    current_date = pd.Timestamp.today()
+
+    # Calculate delivery delay and flag backdating and receipt issues
+    df['Delivery Delay'] = (df['Delivery Date'] - df['Document Date']).dt.days.fillna(-1)
+    df['Why PO Delay'] = classify_delays(df, current_date)
+
+    # Identify overbilling cases (invoice > order)
+    df['Overbilling_Flag'] = df['PO Invoice Value in Loc. Curr.'] > df['PO Ordered Value in Loc. Curr.']
+
+    # Calculate the overbilling amount (invoice - order)
+    df['Overbilling Amount'] = df['PO Invoice Value in Loc. Curr.'] - df['PO Ordered Value in Loc. Curr.']
+
+    # Check for on-time delivery
+    df['On_Time'] = (df['Delivery Date'] >= current_date) | (df['Still to Deliver'] == 0)
+    return df
+
+
+# Add the row-level columns and aggregate the spend cube, measuring both into stages.
+# Everything else is derived lazily from these two frames by AnalysisFrames.
+def process_upload(df, stages=None):
+    stages = [] if stages is None else stages
+    with measure_stage(stages, 'row_columns') as record:
+        df = add_row_columns(df)
+        record['rows'] = len(df)
+
+    # Single scan of the frame; every spend summary is a roll-up of this cube
+    with measure_stage(stages, 'spend_cube') as record:
+        spend_cube = build_spend_cube(df)
+        record['rows'] = len(spend_cube)
+    return {'df': df, 'spend_cube': spend_cube}
+
+
+# Builders for the derived frames, keyed by frame name. Each takes the
+# AnalysisFrames it belongs to, so it can pull in the frames it depends on.
+FRAME_BUILDERS = {}
+
+
+def frame_builder(name):
+    def register(func):
+        FRAME_BUILDERS[name] = func
+        return func
+    return register
+
+
+# Tables that are a subset of df's rows are stored as positions into df and
+# materialized again on each access, so a session holds those rows only once. The
+# builder returns the positions; shape, if given, turns the selected rows into the
+# table, e.g. by picking columns.
+ROW_TABLES = {}
+
+
+def row_builder(name, shape=None):
+    def register(func):
+        FRAME_BUILDERS[name] = func
+        ROW_TABLES[name] = shape
+        return func
+    return register
+
+
+# Positions of the rows where a boolean Series holds
+def row_positions(mask):
+    return np.flatnonzero(mask.to_numpy())
+
+
+# Processed frames for one upload: the base frames are held as given, derived
+# frames are built on first access and memoized. A lock per frame lets the
+# warm-up workers and the script thread ask for the same frame safely. Builds and
+# reports written from these frames are measured into stages.
+class AnalysisFrames:
+    def __init__(self, base_frames):
+        self.frames = dict(base_frames)
+        self.locks = {name: threading.Lock() for name in FRAME_BUILDERS}
+        self.stages = []
+
+    def __getitem__(self, name):
+        stored = self.build(name)
+        if name in ROW_TABLES:
+            rows = self.frames['df'].take(stored)
+            shape = ROW_TABLES[name]
+            return rows if shape is None else shape(rows)
+        return stored
+
+    # Build a frame if needed and return what is stored for it, which for row
+    # tables is their positions into df
+    def build(self, name):
+        if name not in self.frames:
+            with self.locks[name]:
+                if name not in self.frames:
+                    with measure_stage(self.stages, f'frame:{name}') as record:
+                        frame = FRAME_BUILDERS[name](self)
+                        record['rows'] = len(frame)
+                    self.frames[name] = frame
+        return self.frames[name]
+
+    def is_built(self, name):
+        return name in self.frames
+
+    # Bytes held for each stored frame: deep memory usage of frames and of the
+    # frames in a dict, and only the positions array of row tables
+    def memory_usage(self):
+        usage = []
+        for name, stored in list(self.frames.items()):
+            if name in ROW_TABLES:
+                usage.append((name, 'row positions', len(stored), stored.nbytes))
+            elif isinstance(stored, dict):
+                usage.append((name, 'frames by key', sum(len(frame) for frame in stored.values()),
+                              sum(int(frame.memory_usage(deep=True).sum()) for frame in stored.values())))
+            else:
+                usage.append((name, 'frame', len(stored), int(stored.memory_usage(deep=True).sum())))
+        return pd.DataFrame(usage, columns=['frame', 'kind', 'rows', 'bytes'])
+
+
+# Vendor-level totals shared by the vendor spend table and the vendor summary
+@frame_builder('vendor_totals')
+def build_vendor_totals(frames):
+    return rollup(frames['spend_cube'], VENDOR_KEYS, QUANTITY_VALUES + SPEND_VALUES)
+
+
+# 1. Total Spend by Vendor
+@frame_builder('total_spend_by_vendor')
+def build_total_spend_by_vendor(frames):
+    total_spend_by_vendor = frames['vendor_totals'][VENDOR_KEYS + SPEND_VALUES].copy()
+    total_spend_by_vendor.columns = ['Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+                                      'Total PO Ordered Value', 'Total PO Invoice Value', 'Total PO Down Payment']
+    return total_spend_by_vendor
+
+
+# 2. Total Spend by Material
+@frame_builder('total_spend_by_material')
+def build_total_spend_by_material(frames):
+    total_spend_by_material = rollup(frames['spend_cube'], ['Material Description', 'IT/NON-IT'], SPEND_VALUES)
+    total_spend_by_material.columns = ['Material Description', 'IT/NON-IT',
+                                        'Total PO Ordered Value', 'Total PO Invoice Value', 'Total PO Down Payment']
+    return total_spend_by_material
+
+
+# 3. Total Spend by Service Area
+@frame_builder('total_spend_by_service_area')
+def build_total_spend_by_service_area(frames):
+    total_spend_by_service_area = rollup(frames['spend_cube'], ['Service Area', 'IT/NON-IT'], SPEND_VALUES)
+    total_spend_by_service_area.columns = ['Service Area', 'IT/NON-IT',
+                                            'Total PO Ordered Value', 'Total PO Invoice Value', 'Total PO Down Payment']
+    return total_spend_by_service_area
+
+
+# 4. Top 10 Vendors by Spend (using Total PO Ordered Value)
+@frame_builder('top_10_vendors')
+def build_top_10_vendors(frames):
+    return top_n(frames['total_spend_by_vendor'], 'Total PO Ordered Value')
+
+
+# 5. Top 10 Materials by Spend (using Total PO Ordered Value)
+@frame_builder('top_10_materials')
+def build_top_10_materials(frames):
+    return top_n(frames['total_spend_by_material'], 'Total PO Ordered Value')
+
+
+# 6. Spend Trends Over Time (Monthly)
+@frame_builder('top_10_vendors_monthly')
+def build_top_10_vendors_monthly(frames):
+    monthly_spend = rollup(frames['spend_cube'], ['Month'] + VENDOR_KEYS, SPEND_VALUES)
+    top_10_vendors_monthly = top_n_per_group(monthly_spend, 'Month', 'PO Ordered Value in Loc. Curr.')
+    top_10_vendors_monthly.columns = ['Month', 'Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+                                      'Total PO Ordered Value', 'Total PO Invoice Value', 'Total PO Down Payment']
+    return top_10_vendors_monthly
+
+
+# Monthly top vendors keyed by month in sorted order, each already sorted by order value
+@frame_builder('top_vendors_by_month')
+def build_top_vendors_by_month(frames):
+    return {month: group.reset_index(drop=True)
+            for month, group in frames['top_10_vendors_monthly'].groupby('Month', sort=True)}
+
+
+# 7. Vendor Order Summary with Delivery Percentage
+@frame_builder('vendor_summary')
+def build_vendor_summary(frames):
+    vendor_summary = frames['vendor_totals'].copy()
+    vendor_summary['Delivery_Percentage'] = np.where(
+        vendor_summary['Ordered Quantity'] > 0,
+        (vendor_summary['Delivery Quantity'] / vendor_summary['Ordered Quantity']) * 100,
+        0
+    ).round(2)
+    vendor_summary.columns = [
+        'Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+        'Total Ordered Quantity', 'Total Delivered Quantity',
+        'Total Pending Quantity', 'Total PO Ordered Value',
+        'Total PO Invoice Value', 'Total PO Down Payment',
+        'Delivery Percentage (%)'
+    ]
+    return vendor_summary
+
+
+# 8. Delayed POs
+DELAYED_PO_COLUMNS = [
+    'Purchasing Document Number', 'Document Date', 'Delivery Date',
+    'Delivery Delay', 'Why PO Delay', 'IT/NON-IT', 'Vendor Number', 'Entity Name'
+]
+
+
+def delayed_po_columns(rows):
+    return rows[[col for col in DELAYED_PO_COLUMNS if col in rows.columns]]
+
+
+@row_builder('delayed_pos', shape=delayed_po_columns)
+def build_delayed_pos(frames):
+    df = frames['df']
+    return row_positions((df['GR Document Number'].isna()) | (df['IR Document Number'].isna()))
+
+
+# 9. Quantity Errors
+@row_builder('quantity_errors')
+def build_quantity_errors(frames):
+    df = frames['df']
+    return row_positions(df['Delivery Quantity'] > df['Ordered Quantity'])
+
+
+# Overbilling cases (invoice > order)
+@row_builder('overbilling_cases')
+def build_overbilling_cases(frames):
+    df = frames['df']
+    return row_positions(df['Overbilling_Flag'])
+
+
+# For focused overbilling analysis, filter records with positive differences
+@row_builder('overbilling_df')
+def build_overbilling_df(frames):
+    df = frames['df']
+    return row_positions(df['Overbilling Amount'] > 0)
+
+
+# Top Vendors by Total Overbilling
+@frame_builder('vendor_overbilling')
+def build_vendor_overbilling(frames):
+    vendor_overbilling = frames['overbilling_df'].groupby('Vendor Name', observed=True, as_index=False)['Overbilling Amount'].sum().pipe(plain_keys)
+    return vendor_overbilling.sort_values(by='Overbilling Amount', ascending=False)
+
+
+# Monthly overbilling totals
+@frame_builder('month_overbilling')
+def build_month_overbilling(frames):
+    return frames['overbilling_df'].groupby('Month', observed=True, as_index=False)['Overbilling Amount'].sum().pipe(plain_keys)
+
+
+# Records invoiced below their order value, with the shortfall as a positive amount
+def with_underbilling_amount(rows):
+    rows['Underbilling Amount'] = -rows['Overbilling Amount']
+    return rows
+
+
+@row_builder('underbilling_df', shape=with_underbilling_amount)
+def build_underbilling_df(frames):
+    df = frames['df']
+    return row_positions(df['Overbilling Amount'] < 0)
+
+
+# Top Vendors by Total Underbilling
+@frame_builder('vendor_underbilling')
+def build_vendor_underbilling(frames):
+    vendor_underbilling = frames['underbilling_df'].groupby('Vendor Name', observed=True, as_index=False)['Underbilling Amount'].sum().pipe(plain_keys)
+    return vendor_underbilling.sort_values(by='Underbilling Amount', ascending=False)
+
+
+# Monthly underbilling totals
+@frame_builder('month_underbilling')
+def build_month_underbilling(frames):
+    return frames['underbilling_df'].groupby('Month', observed=True, as_index=False)['Underbilling Amount'].sum().pipe(plain_keys)
+
+
+# Positions of a row table reordered by an amount, largest first; sorted like
+# DataFrame.sort_values, so ties keep the order they had before
+def sorted_positions(positions, amounts):
+    return positions[amounts.reset_index(drop=True).sort_values(ascending=False).index.to_numpy()]
+
+
+# Underbilling report sheet with Document Date and Delivery Date
+UNDERBILLING_ANALYSIS_COLUMNS = [
+    'Purchasing Document Number', 'Document Date', 'Delivery Date',
+    'Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+    'PO Ordered Value in Loc. Curr.', 'PO Invoice Value in Loc. Curr.',
+    'Underbilling Amount'
+]
+
+
+@row_builder('underbilling_analysis',
+             shape=lambda rows: with_underbilling_amount(rows)[UNDERBILLING_ANALYSIS_COLUMNS])
+def build_underbilling_analysis(frames):
+    positions = frames.build('underbilling_df')
+    return sorted_positions(positions, -frames['df']['Overbilling Amount'].take(positions))
+
+
+# Overbilling report sheet with Document Date and Delivery Date
+OVERBILLING_ANALYSIS_COLUMNS = [
+    'Purchasing Document Number', 'Document Date', 'Delivery Date',
+    'Vendor Name', 'Vendor Number', 'Entity Name', 'IT/NON-IT',
+    'PO Ordered Value in Loc. Curr.', 'PO Invoice Value in Loc. Curr.',
+    'Overbilling Amount'
+]
+
+
+@row_builder('overbilling_analysis', shape=lambda rows: rows[OVERBILLING_ANALYSIS_COLUMNS])
+def build_overbilling_analysis(frames):
+    positions = frames.build('overbilling_df')
+    return sorted_positions(positions, frames['df']['Overbilling Amount'].take(positions))
+
+
+# Monthly order and invoice totals
+@frame_builder('spend_trend')
+def build_spend_trend(frames):
+    return rollup(frames['spend_cube'], ['Month'], SPEND_VALUES[:2])
+
+
+# Order and invoice totals per vendor
+@frame_builder('vendor_spend')
+def build_vendor_spend(frames):
+    return rollup(frames['spend_cube'], ['Vendor Name'], SPEND_VALUES[:2])
+
+
+# Pending delivery quantity (ordered - delivered) per vendor
+@frame_builder('pending_deliveries')
+def build_pending_deliveries(frames):
+    return rollup(frames['spend_cube'], ['Vendor Name'], ['Pending Deliveries'])
+
+
+# Down payments per vendor
+@frame_builder('down_payment')
+def build_down_payment(frames):
+    return rollup(frames['spend_cube'], ['Vendor Name'], ['PO Down Payment'])
+
+
+# Order totals per entity
+@frame_builder('entity_spend')
+def build_entity_spend(frames):
+    return rollup(frames['spend_cube'], ['Entity Name'], SPEND_VALUES[:1])
+
+
+# Order and invoice totals by Service Area for every entity, keyed by entity name
+# in sorted order and sorted by order value, so switching entities is a lookup
+@frame_builder('entity_service_area_spend')
+def build_entity_service_area_spend(frames):
+    spend = rollup(frames['spend_cube'], ['Entity Name', 'Service Area'], SPEND_VALUES[:2])
+    spend = spend.sort_values(by='PO Ordered Value in Loc. Curr.', ascending=False)
+    by_entity = {entity: group.drop(columns='Entity Name')
+                 for entity, group in spend.groupby('Entity Name', sort=False)}
+    empty = spend.iloc[0:0].drop(columns='Entity Name')
+    return {entity: by_entity.get(entity, empty) for entity in frames['entity_spend']['Entity Name']}
+
+
+# Serve the report for this dataset, report layout and format from the disk cache,
+# writing it on first request, so repeat downloads and other sessions reuse the file
+def cached_report(frames, dataset_key, report_format='Excel'):
+    extension, _, writer = REPORT_FORMATS[report_format]
+    report_path = CACHE_DIR / f'report-{CACHE_VERSION}-{dataset_key}.{extension}'
+    if refresh_cache(report_path):
+        return report_path
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = temp_path(report_path)
+    rows = report_rows(frames)
+    try:
+        with measure_stage(frames.stages, f'report:{extension}') as record:
+            writer(frames, str(tmp_path))
+            record['rows'] = rows
+        tmp_path.replace(report_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    prune_cache(f'report-*.{extension}')
+    return report_path
+
+
+# Rows across all report tables. Building the tables here, before the report stage
+# starts, keeps their builds out of the report's measurement.
+def report_rows(frames):
+    return sum(len(frames.build(frame_name)) for frame_name in REPORT_SHEETS.values())
+
+
+# Temporary name a cache file is written under before it is moved into place, so
+# concurrent sessions never read or clobber a partial file
+def temp_path(path):
+    return path.with_suffix(f'.{os.getpid()}-{threading.get_ident()}.tmp')
+
+
+# Mark a cache file as just used, for the pruning below. Unlike Path.touch this
+# never creates the file: when another session has pruned it since, it returns
+# False and the caller rebuilds it rather than serving an empty file.
+def refresh_cache(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+# Drop the least recently used cache files beyond the size bound. Other sessions
+# prune the same directory, so files may vanish between the listing and here.
+def prune_cache(pattern, keep=CACHE_MAX_ENTRIES):
+    files = []
+    for path in CACHE_DIR.glob(pattern):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    files.sort(key=lambda entry: entry[0], reverse=True)
+    for _, path in files[keep:]:
+        path.unlink(missing_ok=True)
+
+
+# Read and process one upload, recording how it was read and the measurements of
+# each stage alongside the frames
+def process_file(file_bytes, file_hash=None):
+    stages = []
+    with measure_stage(stages, 'read') as record:
+        df, reader = read_upload(file_bytes, file_hash)
+        record.update(rows=len(df), detail=reader)
+    frames = process_upload(df, stages)
+    frames['load_info'] = {'reader': reader, 'read_seconds': stages[0]['seconds'], 'rows': len(df),
+                           'stages': stages}
+    return frames
+
+
+# Processed frames from the disk cache, rebuilt from the workbook when this file
+# has not been processed today
+def load_processed(file_hash, as_of, file_bytes):
+    cache_path = CACHE_DIR / f'processed-{CACHE_VERSION}-{file_hash}-{as_of}.pkl'
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as fh:
+                frames = pickle.load(fh)
+            refresh_cache(cache_path)
+            return frames
+        except Exception:
+            # Truncated files and pickles referring to code that has since moved
+            # are rebuilt like any other cache miss
+            cache_path.unlink(missing_ok=True)
+
+    frames = process_file(file_bytes, file_hash)
+
+    # Write atomically so a concurrent session never reads a partial file. The cache
+    # only saves work: when it cannot be written, e.g. in a read-only deployment,
+    # the frames are returned all the same.
+    tmp_path = temp_path(cache_path)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(tmp_path, 'wb') as fh:
+                pickle.dump(frames, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(cache_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    except OSError as error:
+        logger.warning('cache=%s write error=%s', cache_path.name, error)
+        return frames
+    prune_cache('processed-*.pkl')
+    return frames
+
+
+# Report format for each file extension the command line accepts
+FORMAT_EXTENSIONS = {extension: report_format for report_format, (extension, _, _) in REPORT_FORMATS.items()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the P2P analysis on a workbook and write the full report.')
+    parser.add_argument('workbook', type=Path, help='P2P export to analyze (.xlsx)')
+    parser.add_argument('-o', '--output', type=Path, default=Path('P2P_Analysis_Report.xlsx'),
+                        help=f'report path; the format follows its extension ({", ".join(FORMAT_EXTENSIONS)})')
+    parser.add_argument('--cube', type=Path, help='also write the spend cube to this Parquet file')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='process the workbook from scratch, bypassing the Parquet sidecar and the processed-frame cache')
+    args = parser.parse_args(argv)
+
+    args.format = next((report_format for extension, report_format in FORMAT_EXTENSIONS.items()
+                        if args.output.name.endswith(f'.{extension}')), None)
+    if args.format is None:
+        parser.error(f'cannot tell the report format of {args.output}; use one of: {", ".join(FORMAT_EXTENSIONS)}')
+    if args.cube is not None and pq is None:
+        parser.error('--cube needs pyarrow')
+    return args
+
+
+# Headless run for cron jobs and benchmarks: workbook in, report (and cube) out
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+    file_bytes = args.workbook.read_bytes()
+
+    start = time.perf_counter()
+    if args.no_cache:
+        processed = process_file(file_bytes)
+    else:
+        file_hash = hashlib.sha256(file_bytes).hexdigest()
+        processed = load_processed(file_hash, pd.Timestamp.today().strftime('%Y-%m-%d'), file_bytes)
+    load_info = processed.pop('load_info')
+    frames = AnalysisFrames(processed)
+    load_seconds = time.perf_counter() - start
+    print(f"Loaded {load_info['rows']:,} rows with {load_info['reader']} in {load_seconds:.2f} s")
+
+    extension, _, writer = REPORT_FORMATS[args.format]
+    rows = report_rows(frames)
+    with measure_stage(frames.stages, f'report:{extension}') as record:
+        writer(frames, str(args.output))
+        record['rows'] = rows
+    print(f"Wrote {args.format} report to {args.output} in {record['seconds']:.2f} s")
+
+    if args.cube is not None:
+        pq.write_table(arrow_table(frames['spend_cube']), args.cube)
+        print(f'Wrote spend cube to {args.cube}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
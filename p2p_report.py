@@ -0,0 +1,188 @@
+# Excel report writing for the P2P analysis. Kept out of p.py so the process
+# pool used for large reports can import the sheet writer in its workers.
+import datetime
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Sheets of the full report in workbook order, with the analysis table behind each
+REPORT_SHEETS = {
+    'Total Spend by Vendor': 'total_spend_by_vendor',
+    'Total Spend by Material': 'total_spend_by_material',
+    'Total Spend by Service Area': 'total_spend_by_service_area',
+    'Top 10 Vendors': 'top_10_vendors',
+    'Top 10 Materials': 'top_10_materials',
+    'Top 10 Vendors Monthly': 'top_10_vendors_monthly',
+    'Vendor Analysis': 'vendor_summary',
+    'Delayed POs': 'delayed_pos',
+    'Quantity Errors': 'quantity_errors',
+    'Overbilling Analysis': 'overbilling_analysis',
+    'Underbilling Analysis': 'underbilling_analysis'
+}
+
+# constant_memory makes xlsxwriter flush every row to disk once the next one
+# starts, so memory stays flat however large the sheets are; in exchange rows
+# must be written in order, which rules out DataFrame.to_excel. Text that looks
+# like a URL stays text: a hyperlink would add a relationship part and a style
+# to the worksheet, which the parallel writer does not carry over.
+WORKBOOK_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_urls': False,
+    'nan_inf_to_errors': True,
+    'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+}
+
+# Same header style pandas uses for to_excel
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+# Reports with at least this many rows across all sheets are written on a
+# process pool, one sheet per task; smaller ones are not worth the start-up cost
+PARALLEL_MIN_ROWS = 200_000
+REPORT_WORKERS = min(len(REPORT_SHEETS), os.cpu_count() or 1)
+
+
+# Write the full report for frames (anything indexable by table name) to path
+def write_report(frames, path, workers=None):
+    tables = [(sheet_name, frames[frame_name]) for sheet_name, frame_name in REPORT_SHEETS.items()]
+    if workers is None:
+        total_rows = sum(len(frame) for _, frame in tables)
+        workers = REPORT_WORKERS if total_rows >= PARALLEL_MIN_ROWS else 1
+
+    if workers > 1:
+        write_report_parallel(tables, path, workers)
+        return
+
+    workbook = xlsxwriter.Workbook(path, WORKBOOK_OPTIONS)
+    header_format = workbook.add_format(HEADER_FORMAT)
+    for sheet_name, frame in tables:
+        write_sheet(workbook.add_worksheet(sheet_name), frame, header_format)
+    workbook.close()
+
+
+def write_sheet(worksheet, frame, header_format):
+    worksheet.write_row(0, 0, [str(col) for col in frame.columns], header_format)
+    for row, values in enumerate(excel_rows(frame), start=1):
+        worksheet.write_row(row, 0, values)
+
+
+# Rows of a frame as plain Python values xlsxwriter can write, with missing values as blanks
+def excel_rows(frame):
+    columns = []
+    for _, series in frame.items():
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = np.array(series.dt.to_pydatetime(), dtype=object)
+        else:
+            values = series.astype(object).to_numpy(copy=True)
+        values[series.isna().to_numpy()] = None
+        columns.append(values)
+    return zip(*columns)
+
+
+# Each worker writes one sheet as a single-sheet workbook; the worksheet XML of
+# those parts is then spliced into a skeleton workbook holding all sheet names.
+# Worksheets written in constant_memory mode use inline strings, so a part only
+# refers to the workbook through style indices, and the skeleton registers the
+# same formats in the same order as every part does (header, then dates).
+def write_report_parallel(tables, path, workers):
+    with tempfile.TemporaryDirectory(prefix='p2p-report-') as tmp_dir:
+        part_paths = [os.path.join(tmp_dir, f'part{index}.xlsx') for index in range(len(tables))]
+        # spawn, because forking the multi-threaded Streamlit server is unsafe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(write_sheet_part, [frame for _, frame in tables], part_paths))
+
+        skeleton_path = os.path.join(tmp_dir, 'skeleton.xlsx')
+        workbook = xlsxwriter.Workbook(skeleton_path, WORKBOOK_OPTIONS)
+        for sheet_name, _ in tables:
+            workbook.add_worksheet(sheet_name)
+        # Register the formats in the order the parts use them; the cells themselves
+        # are replaced along with the rest of the sheet
+        first_sheet = workbook.worksheets()[0]
+        first_sheet.write_string(0, 0, 'header', workbook.add_format(HEADER_FORMAT))
+        first_sheet.write_datetime(1, 0, datetime.datetime(2000, 1, 1))
+        workbook.close()
+
+        with zipfile.ZipFile(skeleton_path) as skeleton, \
+                zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as report:
+            for item in skeleton.infolist():
+                match = re.fullmatch(r'xl/worksheets/sheet(\d+)\.xml', item.filename)
+                if match is None:
+                    report.writestr(item, skeleton.read(item))
+                    continue
+                sheet_index = int(match.group(1)) - 1
+                with zipfile.ZipFile(part_paths[sheet_index]) as part, \
+                        part.open('xl/worksheets/sheet1.xml') as source, \
+                        report.open(item.filename, 'w', force_zip64=True) as target:
+                    # Every part is the active sheet of its own workbook; only the
+                    # first sheet of the report should be selected
+                    head = source.read(4096)
+                    if sheet_index > 0:
+                        head = head.replace(b' tabSelected="1"', b'', 1)
+                    target.write(head)
+                    shutil.copyfileobj(source, target)
+
+
+def write_sheet_part(frame, part_path):
+    workbook = xlsxwriter.Workbook(part_path, WORKBOOK_OPTIONS)
+    write_sheet(workbook.add_worksheet(), frame, workbook.add_format(HEADER_FORMAT))
+    workbook.close()
+
+
+# Arrow table for a frame, without its index; Excel columns mixing numbers and
+# text cannot be stored as one Arrow type, so those are written as text
+def arrow_table(frame):
+    frame = frame.copy(deep=False)
+    for col in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            frame[col] = frame[col].astype(str).where(frame[col].notna())
+    frame.columns = [str(col) for col in frame.columns]
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+# The same tables as one file each in a zip archive, named after the table, for
+# tools that ingest the report programmatically and have no use for xlsx styling.
+# Members that are already compressed are stored rather than deflated again.
+def write_export(frames, path, extension, write_table, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, 'w', compression) as archive:
+        for frame_name in REPORT_SHEETS.values():
+            with archive.open(f'{frame_name}.{extension}', 'w', force_zip64=True) as member:
+                write_table(frames[frame_name], member)
+
+
+def write_parquet_export(frames, path):
+    write_export(frames, path, 'parquet', lambda frame, member: pq.write_table(arrow_table(frame), member))
+
+
+def write_csv_gz_export(frames, path):
+    write_export(frames, path, 'csv.gz',
+                 lambda frame, member: frame.to_csv(member, index=False, compression={'method': 'gzip', 'mtime': 0}))
+
+
+def write_csv_export(frames, path):
+    write_export(frames, path, 'csv', lambda frame, member: frame.to_csv(member, index=False),
+                 compression=zipfile.ZIP_DEFLATED)
+
+
+# Formats the full report can be downloaded in: label -> (file extension, MIME type, writer)
+REPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', write_report),
+    'Parquet (zip)': ('parquet.zip', 'application/zip', write_parquet_export),
+    'CSV.gz (zip)': ('csv.gz.zip', 'application/zip', write_csv_gz_export),
+    'CSV (zip)': ('csv.zip', 'application/zip', write_csv_export)
+}
+if pq is None:
+    del REPORT_FORMATS['Parquet (zip)']
@@ -0,0 +1,179 @@
+# Seeded synthetic P2P exports for scale testing, with the columns p.py expects.
+#
+#   python p2p_synthetic.py 1000000 -o synthetic.xlsx [--vendors 500] [--anomaly-rate 0.05]
+#
+# Workbooks are capped at Excel's row limit; larger datasets are written as Parquet.
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from p2p_pipeline import SOURCE_COLUMNS
+from p2p_report import HEADER_FORMAT, WORKBOOK_OPTIONS, arrow_table, write_sheet
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Rows a worksheet holds below its header row
+EXCEL_MAX_ROWS = 1_048_576 - 1
+
+# Service areas with their IT/NON-IT classification; every material belongs to one
+SERVICE_AREAS = {
+    'Software': 'IT',
+    'Hardware': 'IT',
+    'IT Services': 'IT',
+    'Telecom': 'IT',
+    'Facilities': 'NON-IT',
+    'Logistics': 'NON-IT',
+    'Consulting': 'NON-IT',
+    'Marketing': 'NON-IT'
+}
+
+# Share of POs still open: partly delivered, with neither goods receipt nor invoice
+OPEN_RATE = 0.1
+
+# Kinds of anomaly the analysis looks for; an anomalous PO gets one of them at random
+ANOMALIES = ['backdated', 'over_delivery', 'overbilling', 'underbilling', 'missing_receipt', 'missing_invoice']
+
+# Columns never blanked by the missing-value rate, so every row stays a distinct PO
+REQUIRED_COLUMNS = ['Purchasing Document Number']
+
+# One material in this many is described by a catalogue web address, as in some
+# exports, so reports are exercised with text xlsxwriter could take for a URL
+URL_MATERIAL_EVERY = 100
+
+
+def material_names(materials):
+    return [f'https://catalog.example.com/material/{i:05d}' if i % URL_MATERIAL_EVERY == URL_MATERIAL_EVERY - 1
+            else f'Material {i:05d}' for i in range(materials)]
+
+
+# Build a synthetic PO export. Vendors are drawn with a Zipf-like skew, as real
+# spend concentrates on a few suppliers; documents span two years from start.
+def generate(rows, vendors=500, materials=2000, entities=6, missing_rate=0.02, anomaly_rate=0.05,
+             seed=0, start='2024-01-01'):
+    rng = np.random.default_rng(seed)
+
+    vendor_weights = 1 / np.arange(1, vendors + 1) ** 1.1
+    vendor = rng.choice(vendors, rows, p=vendor_weights / vendor_weights.sum())
+    material = rng.integers(0, materials, rows)
+    material_area = rng.integers(0, len(SERVICE_AREAS), materials)
+    area = material_area[material]
+    area_it = np.array([SERVICE_AREAS[name] == 'IT' for name in SERVICE_AREAS])
+
+    document_date = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, 730, rows), unit='D')
+    delivery_date = document_date + pd.to_timedelta(rng.integers(0, 61, rows), unit='D')
+
+    ordered_quantity = rng.integers(1, 501, rows).astype(float)
+    open_po = rng.random(rows) < OPEN_RATE
+    delivered_share = np.where(open_po, rng.integers(0, 10, rows) / 10, 1.0)
+    delivery_quantity = np.floor(ordered_quantity * delivered_share)
+    unit_price = np.round(rng.lognormal(6, 1.2, rows), 2)
+    ordered_value = np.round(ordered_quantity * unit_price, 2)
+    invoice_value = np.round(delivery_quantity * unit_price, 2)
+    down_payment = np.where(rng.random(rows) < 0.1, np.round(ordered_value * rng.uniform(0.1, 0.3, rows), 2), 0.0)
+    has_receipt = ~open_po
+    has_invoice = ~open_po
+
+    anomaly = np.where(rng.random(rows) < anomaly_rate, rng.integers(0, len(ANOMALIES), rows), -1)
+    for code, kind in enumerate(ANOMALIES):
+        hit = anomaly == code
+        count = int(hit.sum())
+        if kind == 'backdated':
+            delivery_date = delivery_date.where(
+                ~hit, document_date - pd.to_timedelta(rng.integers(1, 31, rows), unit='D'))
+        elif kind == 'over_delivery':
+            delivery_quantity[hit] = ordered_quantity[hit] + rng.integers(1, 51, count)
+        elif kind == 'overbilling':
+            invoice_value[hit] = np.round(ordered_value[hit] * rng.uniform(1.01, 1.3, count), 2)
+        elif kind == 'underbilling':
+            invoice_value[hit] = np.round(ordered_value[hit] * rng.uniform(0.5, 0.99, count), 2)
+        elif kind == 'missing_receipt':
+            has_receipt[hit] = False
+            has_invoice[hit] = False
+        elif kind == 'missing_invoice':
+            has_invoice[hit] = False
+
+    po_number = 4500000000 + np.arange(rows)
+    df = pd.DataFrame({
+        'Purchasing Document Number': po_number,
+        'Document Date': document_date,
+        'Delivery Date': delivery_date,
+        'GR Document Number': np.where(has_receipt, po_number + 500000000, np.nan),
+        'IR Document Number': np.where(has_invoice, po_number + 600000000, np.nan),
+        'Vendor Name': pd.Categorical.from_codes(vendor, [f'Vendor {i:05d}' for i in range(vendors)]),
+        'Vendor Number': pd.Categorical.from_codes(vendor, [str(100000 + i) for i in range(vendors)]),
+        'Entity Name': pd.Categorical.from_codes(
+            rng.integers(0, entities, rows), [f'Entity {i:02d}' for i in range(entities)]),
+        'IT/NON-IT': pd.Categorical.from_codes(area_it[area].astype(np.int8), ['NON-IT', 'IT']),
+        'Service Area': pd.Categorical.from_codes(area, list(SERVICE_AREAS)),
+        'Material Description': pd.Categorical.from_codes(material, material_names(materials)),
+        'PO Ordered Value in Loc. Curr.': ordered_value,
+        'PO Invoice Value in Loc. Curr.': invoice_value,
+        'Ordered Quantity': ordered_quantity,
+        'Delivery Quantity': delivery_quantity,
+        'PO Down Payment': down_payment,
+        'Still to Deliver': np.maximum(ordered_quantity - delivery_quantity, 0)
+    }, columns=SOURCE_COLUMNS)
+
+    # Blank cells the way partial exports do, independently per column
+    for col in df.columns.difference(REQUIRED_COLUMNS):
+        blank = rng.random(rows) < missing_rate
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].mask(blank)
+        else:
+            df[col] = df[col].where(~blank)
+    return df
+
+
+# Write the frame as a single-sheet workbook, or as Parquet for a .parquet path
+def write_dataset(df, path):
+    path = Path(path)
+    if path.suffix == '.parquet':
+        if pq is None:
+            raise RuntimeError('writing Parquet needs pyarrow')
+        pq.write_table(arrow_table(df), path)
+        return
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f'{len(df):,} rows do not fit in a worksheet (at most {EXCEL_MAX_ROWS:,}); write Parquet instead')
+
+    workbook = xlsxwriter.Workbook(str(path), WORKBOOK_OPTIONS)
+    write_sheet(workbook.add_worksheet(), df, workbook.add_format(HEADER_FORMAT))
+    workbook.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic P2P export for scale testing.')
+    parser.add_argument('rows', type=int, help='number of PO rows')
+    parser.add_argument('-o', '--output', type=Path, default=Path('synthetic.xlsx'),
+                        help='output path, .xlsx or .parquet')
+    parser.add_argument('--vendors', type=int, default=500, help='distinct vendors')
+    parser.add_argument('--materials', type=int, default=2000, help='distinct materials')
+    parser.add_argument('--entities', type=int, default=6, help='distinct entities')
+    parser.add_argument('--missing-rate', type=float, default=0.02, help='share of blank cells per column')
+    parser.add_argument('--anomaly-rate', type=float, default=0.05,
+                        help=f'share of POs with one anomaly ({", ".join(ANOMALIES)})')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    if args.output.suffix not in ('.xlsx', '.parquet'):
+        parser.error(f'unsupported output format {args.output.suffix!r}; use .xlsx or .parquet')
+    if args.output.suffix == '.xlsx' and args.rows > EXCEL_MAX_ROWS:
+        parser.error(f'an xlsx file holds at most {EXCEL_MAX_ROWS:,} rows; write .parquet instead')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    df = generate(args.rows, vendors=args.vendors, materials=args.materials, entities=args.entities,
+                  missing_rate=args.missing_rate, anomaly_rate=args.anomaly_rate, seed=args.seed)
+    write_dataset(df, args.output)
+    print(f'Wrote {len(df):,} rows to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())